@@ -1,67 +1,189 @@
 """Turn sequence analysis module."""
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import ast
+import re
 import numpy as np
 import pandas as pd
 import scipy.stats as st
-import matplotlib.pyplot as plt
-import osmnx as ox
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
+from cartopy.mpl.geoaxes import GeoAxes
 from turn_sequence.map_model import MapModel
 from turn_sequence import utils
 from turn_sequence.config import ProjectConfig, PointColumns, DirectionColumns, GoogleSheetConfig
 
-def get_all_dfs_from_gsheets(sheet_config: GoogleSheetConfig) -> tuple[pd.DataFrame]:
-    """Gets the places, points, and directions dataframes from Google Sheets."""
-    places_df = utils.get_gsheet_df(sheet_config.id, sheet_config.gid.places)
-    points_df = utils.get_gsheet_df(sheet_config.id, sheet_config.gid.points)
-    directions_df = utils.get_gsheet_df(sheet_config.id, sheet_config.gid.directions)
+# A stringified list of strings as stored in Google Sheets, e.g. "['LR', 'RR']"
+LIST_PATTERN = re.compile(r"\[\s*(?:'[^']*'\s*(?:,\s*'[^']*'\s*)*)?\]")
+# Matches each quoted element of a list matched by LIST_PATTERN
+LIST_ELEMENT_PATTERN = re.compile(r"'([^']*)'")
+
+# Index label of the statistics row computed over all paths
+TOTAL_ROW = "Total"
+
+# Plots are in lat/lon, so one PlateCarree CRS is shared by the axes and the place polygons
+PLATE_CARREE = ccrs.PlateCarree()
+
+# Base map features drawn under every plot, with their keyword arguments
+MAP_FEATURES = (
+    (cfeature.LAND, {}),
+    (cfeature.OCEAN, {}),
+    (cfeature.COASTLINE, {}),
+    (cfeature.BORDERS, {"linestyle": ":"})
+)
+
+# PNG save options. The Software entry is dropped so files only change when the plot does
+SAVEFIG_KWARGS = {"dpi": 100, "metadata": {"Software": None}}
+
+# All possible pairs of consecutive turns, and the ones that alternate direction
+DOUBLE_TURNS = ("LL", "RR", "LR", "RL")
+ALTERNATING_DOUBLE_TURNS = ("LR", "RL")
+
+def get_all_dfs_from_gsheets(sheet_config: GoogleSheetConfig, direction_columns: DirectionColumns = None) -> tuple[pd.DataFrame]:
+    """
+    Gets the places, points, and directions dataframes from Google Sheets.
+    The three worksheets are independent, so they are downloaded concurrently.
+    If direction_columns is given, the direction pairs column is parsed from its string form
+    into lists while the CSV is read. Otherwise it is left as strings.
+    """
+    direction_converters = None
+    if direction_columns is not None:
+        direction_converters = {direction_columns.direction_pairs: parse_list_cell}
+    converters = (None, None, direction_converters)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        places_df, points_df, directions_df = executor.map(
+            lambda gid, gid_converters: utils.get_gsheet_df(sheet_config.id, gid, converters=gid_converters),
+            sheet_config.gid,
+            converters
+        )
     return places_df, points_df, directions_df
 
+def parse_list_cell(cell: str) -> list[str]:
+    """
+    Parses a stringified list of strings from Google Sheets, e.g. "['LR', 'RR']" -> ['LR', 'RR'].
+    An empty cell parses to an empty list.
+    Raises ValueError if the cell is not a list of single quoted strings.
+    """
+    if cell == "":
+        return []
+    if LIST_PATTERN.fullmatch(cell) is None:
+        raise ValueError(f"Expected a list of strings such as \"['LR', 'RR']\". Instead got: {cell}")
+    return LIST_ELEMENT_PATTERN.findall(cell)
+
 def alternating_turn_metric(double_turns: list[str]) -> float:
-    """Returns fraction of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT."""
-    num_alternating_turns = 0
-    for double_turn in double_turns:
-        if double_turn not in ["LL", "RR", "LR", "RL"]:
-            raise ValueError(f"All double turns must be one of 'LL', 'RR', 'LR', or 'RL'. Instead got: {double_turn}")
-        if double_turn == "RL" or double_turn == "LR":
-            num_alternating_turns += 1
-    return num_alternating_turns / len(double_turns)
+    """
+    Returns fraction of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT.
+    If there are no double turns, e.g. a path with fewer than two turns, return 0.
+    """
+    if len(double_turns) == 0:
+        return 0.0
+    double_turns = np.asarray(double_turns)
+    # Validated with the same DOUBLE_TURNS as alternating_turn_percentages.
+    # isin also flags non-string values such as None instead of failing to compare them.
+    invalid = ~np.isin(double_turns, DOUBLE_TURNS)
+    if invalid.any():
+        raise ValueError(f"All double turns must be one of 'LL', 'RR', 'LR', or 'RL'. Instead got: {double_turns[invalid][0]}")
+    # A validated pair is two ASCII letters, and it alternates exactly when the letters differ
+    letters = double_turns.astype("S2").view(np.uint8).reshape(-1, 2)
+    return float(np.count_nonzero(letters[:, 0] ^ letters[:, 1]) / len(letters))
+
+def alternating_turn_percentages(directions_df: pd.DataFrame, direction_columns: DirectionColumns) -> pd.Series:
+    """
+    Returns the percentage of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT for each path in a dataframe.
+    The direction pairs column holds lists, or their string form as read by utils.get_gsheet_df.
+    Paths without any double turns are dropped.
+    The result is indexed by the position of each path in directions_df, so paths sharing an index label are kept apart.
+    """
+    # flatten to one double turn per row keeping the path position.
+    # Empty lists explode to NaN and are dropped.
+    direction_pairs = directions_df[direction_columns.direction_pairs].reset_index(drop=True)
+    # Cells read without a converter are still strings. Empty cells are NaN and are dropped below.
+    direction_pairs = direction_pairs.map(lambda cell: parse_list_cell(cell) if isinstance(cell, str) else cell)
+    double_turns = direction_pairs.explode().dropna()
+    invalid = ~double_turns.isin(DOUBLE_TURNS)
+    if invalid.any():
+        raise ValueError(f"All double turns must be one of 'LL', 'RR', 'LR', or 'RL'. Instead got: {double_turns[invalid].iloc[0]}")
+    is_alternating = double_turns.isin(ALTERNATING_DOUBLE_TURNS)
+    return is_alternating.groupby(level=0, sort=False).mean() * 100
 
 def calculate_alternating_turn_percentage(directions_df: pd.DataFrame, direction_columns: DirectionColumns) -> list[float]:
     """Returns a list of percentages of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT for all paths in a dataframe."""
-    double_turns_raw = directions_df.loc[:, direction_columns.direction_pairs].dropna()
-    # convert from string to list
-    double_turns_sequence = double_turns_raw.apply(ast.literal_eval)
-    alternating_turn_percentages = []
-    for double_turns in double_turns_sequence:
-        if not double_turns:
-            continue
-        fraction_alternating_turns = alternating_turn_metric(double_turns)
-        percentage_alternating_turns = fraction_alternating_turns * 100
-        alternating_turn_percentages.append(percentage_alternating_turns)
-    return alternating_turn_percentages
+    return alternating_turn_percentages(directions_df, direction_columns).tolist()
 
 def place_alternating_turn_percentages(name: str, places_df: pd.DataFrame, directions_df: pd.DataFrame, config: ProjectConfig) -> list[float]:
-    """Returns a list of percentages of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT for all paths in a given city."""
-    place_mask = places_df[config.place_columns.name] == name
-    place_id = places_df.loc[place_mask, config.place_columns.id].item()
-    directions_mask = directions_df[config.direction_columns.place_id] == place_id
-    filtered_directions_df = directions_df[directions_mask]
-    alternating_turn_percentages = calculate_alternating_turn_percentage(filtered_directions_df, config.direction_columns)
-    return alternating_turn_percentages
-
-def plot_place_points_from_model(model: MapModel, point_columns: PointColumns, plot_path: Path) -> None:
-    """Plots points on map."""
-    plt.figure(figsize=(8, 6))
-    ax = plt.axes(projection=ccrs.PlateCarree())
+    """
+    Returns a list of percentages of turns that alternate either LEFT -> RIGHT or RIGHT -> LEFT for all paths in a given city.
+    The place id and the place's directions are found with hash lookups instead of comparing every row.
+    """
+    place_id = places_df.set_index(config.place_columns.name).at[name, config.place_columns.id]
+    directions_by_place = directions_df.groupby(config.direction_columns.place_id, sort=False)
+    if place_id not in directions_by_place.groups:
+        return []
+    return calculate_alternating_turn_percentage(directions_by_place.get_group(place_id), config.direction_columns)
 
-    # map features
-    ax.add_feature(cfeature.LAND)
-    ax.add_feature(cfeature.OCEAN)
-    ax.add_feature(cfeature.COASTLINE)
-    ax.add_feature(cfeature.BORDERS, linestyle=':')
+def _describe_percentages(grouped: pd.core.groupby.SeriesGroupBy) -> pd.DataFrame:
+    """Returns the mean, population standard deviation, standard error, and count of each group."""
+    return pd.DataFrame({
+        "mean": grouped.mean(),
+        "std": grouped.std(ddof=0),
+        "sem": grouped.sem(),
+        "count": grouped.count()
+    })
+
+def place_alternating_turn_statistics(places_df: pd.DataFrame,
+                                      directions_df: pd.DataFrame,
+                                      config: ProjectConfig,
+                                      confidence: float = 0.95) -> pd.DataFrame:
+    """
+    Returns the mean, standard deviation, standard error, number of paths, and confidence interval
+    of the alternating turn percentage for every place in a single pass over directions_df.
+    The result is indexed by place name, followed by a TOTAL_ROW over all paths.
+    Places without any paths with double turns have no row.
+    """
+    percentages = alternating_turn_percentages(directions_df, config.direction_columns)
+    # percentages is indexed by path position, so look up place ids by position as well
+    place_ids = directions_df[config.direction_columns.place_id].iloc[percentages.index]
+    place_names = places_df.set_index(config.place_columns.id)[config.place_columns.name]
+    total_stats = _describe_percentages(percentages.groupby(np.full(len(percentages), TOTAL_ROW)))
+    # The total row is always reported, with no paths and NaN statistics when no path has double turns
+    total_stats = total_stats.reindex([TOTAL_ROW]).fillna({"count": 0})
+    stats = pd.concat([
+        _describe_percentages(percentages.groupby(place_ids.map(place_names).to_numpy())),
+        total_stats
+    ])
+
+    # One vectorized t critical value lookup for every row instead of a t.interval call per place
+    critical_values = st.t.ppf((1 + confidence) / 2, stats["count"] - 1)
+    half_width = critical_values * stats["sem"]
+    stats["ci_lower"] = stats["mean"] - half_width
+    stats["ci_upper"] = stats["mean"] + half_width
+    return stats
+
+def create_map_axes() -> GeoAxes:
+    """Creates lat/lon map axes on a new off-screen figure."""
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    return fig.add_subplot(projection=PLATE_CARREE)
+
+def _reset_map_axes(ax: GeoAxes | None) -> GeoAxes:
+    """
+    Returns map axes with the base map features drawn.
+    Reuses ax if given, clearing the previous plot, so a loop over places
+    does not build a new figure and projection for every plot.
+    The axes projection is PlateCarree, so lon/lat data can be plotted without a transform.
+    """
+    if ax is None:
+        ax = create_map_axes()
+    else:
+        ax.cla()
+    for feature, kwargs in MAP_FEATURES:
+        ax.add_feature(feature, **kwargs)
+    return ax
+
+def plot_place_points_from_model(model: MapModel, point_columns: PointColumns, plot_path: Path, ax: GeoAxes | None = None) -> None:
+    """Plots points on map."""
+    ax = _reset_map_axes(ax)
 
     # lat/lon map bounds
     bounds = [
@@ -70,33 +192,24 @@ def plot_place_points_from_model(model: MapModel, point_columns: PointColumns, p
         model.place.lat_min,
         model.place.lat_max
         ]
-    ax.set_extent(bounds, crs=ccrs.PlateCarree())
+    ax.set_extent(bounds)
 
     # plot the grid points
-    ax.plot(model.points.df[point_columns.grid_lon], model.points.df[point_columns.grid_lat], 'r+', transform=ccrs.PlateCarree())
+    ax.plot(model.points.df[point_columns.grid_lon], model.points.df[point_columns.grid_lat], 'r+')
 
     # plot the snapped points
-    ax.plot(model.points.df[point_columns.snapped_lon], model.points.df[point_columns.snapped_lat], 'go', transform=ccrs.PlateCarree())
+    ax.plot(model.points.df[point_columns.snapped_lon], model.points.df[point_columns.snapped_lat], 'go')
 
     # plot the place polygon
-    ax.add_geometries([model.place.polygon], crs=ccrs.PlateCarree(),
+    ax.add_geometries([model.place.polygon], crs=PLATE_CARREE,
                   edgecolor='blue', facecolor='none', linewidth=2)
 
-    plt.savefig(plot_path)
-    plt.close()
+    ax.figure.savefig(plot_path, **SAVEFIG_KWARGS)
 
-def plot_place_points_from_df(name: str, points_df: pd.DataFrame, point_columns: PointColumns, plot_path: Path) -> None:
+def plot_place_points_from_df(name: str, points_df: pd.DataFrame, point_columns: PointColumns, plot_path: Path, ax: GeoAxes | None = None) -> None:
     """Plots points on map."""
-    gdf = ox.geocode_to_gdf(name)
-
-    plt.figure(figsize=(8, 6))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-
-    # map features
-    ax.add_feature(cfeature.LAND)
-    ax.add_feature(cfeature.OCEAN)
-    ax.add_feature(cfeature.COASTLINE)
-    ax.add_feature(cfeature.BORDERS, linestyle=':')
+    gdf = utils.cached_geocode_to_gdf(name)
+    ax = _reset_map_axes(ax)
 
     # lat/lon map bounds
     lon_min = gdf.loc[0,'bbox_west']
@@ -105,24 +218,30 @@ def plot_place_points_from_df(name: str, points_df: pd.DataFrame, point_columns:
     lat_max = gdf.loc[0,'bbox_north']
     
     bounds = [lon_min, lon_max, lat_min, lat_max]
-    ax.set_extent(bounds, crs=ccrs.PlateCarree())
+    ax.set_extent(bounds)
 
     # plot the grid points
     ax.plot(points_df[point_columns.grid_lon], points_df[point_columns.grid_lat], 'r+',
-            label='Grid Points', transform=ccrs.PlateCarree())
+            label='Grid Points')
 
     # plot the snapped points
     ax.plot(points_df[point_columns.snapped_lon], points_df[point_columns.snapped_lat], 'go',
-            label='Snapped to Road Points', transform=ccrs.PlateCarree())
+            label='Snapped to Road Points')
 
     # plot the place polygon
     polygon = gdf.loc[0,'geometry']
-    ax.add_geometries([polygon], crs=ccrs.PlateCarree(), edgecolor='blue', facecolor='none', linewidth=2)
+    ax.add_geometries([polygon], crs=PLATE_CARREE, edgecolor='blue', facecolor='none', linewidth=2)
 
-    plt.title(name)
-    plt.legend()
-    plt.savefig(plot_path, bbox_inches='tight', pad_inches=0.2)
-    plt.close()
+    ax.set_title(name)
+    ax.legend()
+    ax.figure.savefig(plot_path, bbox_inches='tight', pad_inches=0.2, **SAVEFIG_KWARGS)
+
+def _format_statistics(stats: pd.Series, confidence: float) -> str:
+    """Formats a row of place_alternating_turn_statistics for printing."""
+    return (f"average percent: {stats['mean']:.1f}\n"
+            f"num paths: {int(stats['count'])}\n"
+            f"std percent: {stats['std']:.1f}\n"
+            f"{confidence*100}% Confidence interval: ({stats['ci_lower']:.1f}, {stats['ci_upper']:.1f})\n")
 
 def main():
     from turn_sequence.config import load_project_config, load_sheet_config
@@ -131,43 +250,28 @@ def main():
     project_config = load_project_config(project_config_path)
     sheet_config_path = Path.cwd() / "config" / "sheet_config.yaml"
     sheet_config = load_sheet_config(sheet_config_path)
-    places_df, points_df, directions_df = get_all_dfs_from_gsheets(sheet_config)
+    places_df, points_df, directions_df = get_all_dfs_from_gsheets(sheet_config, project_config.direction_columns)
 
     plot_dir = Path.cwd() / "plots"
     plot_dir.mkdir(exist_ok=True)
 
-    # Calculate alternating turn percentage and statistics for each place
+    # Calculate alternating turn percentage and statistics for each place and in total
     confidence = 0.95
+    place_stats = place_alternating_turn_statistics(places_df, directions_df, project_config, confidence)
+    # One set of axes is cleared and redrawn for every place
+    ax = create_map_axes()
     for name in project_config.map_.places:
         plotname = name.lower().replace(', ', '_') + '.png'
         plot_path = plot_dir / plotname
-        plot_place_points_from_df(name, points_df, project_config.point_columns, plot_path)
-        alternating_turn_percentages = place_alternating_turn_percentages(name, places_df, directions_df, project_config)
-        if len(alternating_turn_percentages) < 2:
+        plot_place_points_from_df(name, points_df, project_config.point_columns, plot_path, ax=ax)
+        num_paths = place_stats.loc[name, "count"] if name in place_stats.index else 0
+        if num_paths < 2:
             print(f"name: {name}\n"
-                  f"insufficient data ({len(alternating_turn_percentages)} paths)\n")
+                  f"insufficient data ({num_paths} paths)\n")
             continue
-        mean_alternating_turn_percentages = np.mean(alternating_turn_percentages)
-        std_alternating_turn_percentages = np.std(alternating_turn_percentages)
-        sem = st.sem(alternating_turn_percentages)
-        ci_lower_bound, ci_upper_bound = st.t.interval(confidence=confidence, df=len(alternating_turn_percentages)-1,loc=mean_alternating_turn_percentages, scale=sem)
-        print((f"name: {name}\n"
-               f"average percent: {mean_alternating_turn_percentages:.1f}\n"
-               f"num paths: {len(alternating_turn_percentages)}\n"
-               f"std percent: {std_alternating_turn_percentages:.1f}\n"
-               f"{confidence*100}% Confidence interval: ({ci_lower_bound:.1f}, {ci_upper_bound:.1f})\n"))
-
-    # Calculate total alternating turn percentage
-    total_alternating_turn_percentages = calculate_alternating_turn_percentage(directions_df, project_config.direction_columns)
-    total_mean_alternating_turn_percentages = np.mean(total_alternating_turn_percentages)
-    std_total_alternating_turn_percentages = np.std(total_alternating_turn_percentages)
-    total_sem = st.sem(total_alternating_turn_percentages)
-    total_ci_lower_bound, total_ci_upper_bound = st.t.interval(confidence=confidence, df=len(total_alternating_turn_percentages)-1,loc=total_mean_alternating_turn_percentages, scale=total_sem)
-    print(("Total\n"
-           f"average percent: {total_mean_alternating_turn_percentages:.1f}\n"
-           f"num paths: {len(total_alternating_turn_percentages)}\n"
-           f"std percent: {std_total_alternating_turn_percentages:.1f}\n"
-           f"{confidence*100}% Confidence interval: ({total_ci_lower_bound:.1f}, {total_ci_upper_bound:.1f})\n"))
+        print(f"name: {name}\n" + _format_statistics(place_stats.loc[name], confidence))
+
+    print("Total\n" + _format_statistics(place_stats.loc[TOTAL_ROW], confidence))
 
 if __name__ == "__main__":
     main()
@@ -1,26 +1,47 @@
 """Handles the parameters and models from config files."""
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
 from pathlib import Path
 import yaml
 
-@dataclass
+# libyaml's C parser when PyYAML was built with it, otherwise the pure Python one
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+@dataclass(slots=True, frozen=True)
 class PathConfig:
     oauth_credentials: Path
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SheetNamesConfig:
     name: str
     place_worksheet: str
     point_worksheet: str
     directions_worksheet: str
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MapConfig:
-    places: list[str]
+    places: tuple[str, ...]
     granularity: int
 
-@dataclass
-class PlaceColumns:
+@dataclass(slots=True, frozen=True)
+class _Columns:
+    """Base for worksheet column names. Iterates over the column names in field order."""
+    _columns: tuple[str, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # The column order is fixed, so build it once. Frozen, so set through object.__setattr__
+        columns = tuple(getattr(self, f.name) for f in fields(self) if f.init)
+        object.__setattr__(self, "_columns", columns)
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def as_tuple(self) -> tuple[str, ...]:
+        """Returns the column names in worksheet order."""
+        return self._columns
+
+@dataclass(slots=True, frozen=True)
+class PlaceColumns(_Columns):
     id: str
     name: str
     display_name: str
@@ -29,19 +50,8 @@ class PlaceColumns:
     lon_min: str
     lon_max: str
 
-    def __iter__(self):
-        yield from (
-            self.id,
-            self.name,
-            self.display_name,
-            self.lat_min,
-            self.lat_max,
-            self.lon_min,
-            self.lon_max,
-        )
-
-@dataclass
-class PointColumns:
+@dataclass(slots=True, frozen=True)
+class PointColumns(_Columns):
     id: str
     place_id: str
     grid_lat: str
@@ -49,18 +59,8 @@ class PointColumns:
     snapped_lat: str
     snapped_lon: str
 
-    def __iter__(self):
-        yield from (
-            self.id,
-            self.place_id,
-            self.grid_lat,
-            self.grid_lon,
-            self.snapped_lat,
-            self.snapped_lon
-        )
-
-@dataclass
-class DirectionColumns:
+@dataclass(slots=True, frozen=True)
+class DirectionColumns(_Columns):
     id: str
     origin_id: str
     destination_id: str
@@ -70,19 +70,7 @@ class DirectionColumns:
     lr_directions: str
     direction_pairs: str
 
-    def __iter__(self):
-        yield from (
-            self.id,
-            self.origin_id,
-            self.destination_id,
-            self.place_id,
-            self.distance_km,
-            self.raw_directions,
-            self.lr_directions,
-            self.direction_pairs
-        )
-
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ProjectConfig:
     path: PathConfig
     sheet: SheetNamesConfig
@@ -91,7 +79,7 @@ class ProjectConfig:
     point_columns: PointColumns
     direction_columns: DirectionColumns
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GoogleIds:
     """Contains the gid for each worksheet for a specific Google sheet."""
     places: int
@@ -99,26 +87,38 @@ class GoogleIds:
     directions: int
 
     def __iter__(self):
-        yield from (
-            self.places,
-            self.points,
-            self.directions
-        )
+        return (getattr(self, f.name) for f in fields(self))
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GoogleSheetConfig:
     """Contains the sheet id and gids for a speecific Google sheet."""
     id: str
     gid: GoogleIds
 
+@lru_cache(maxsize=None)
+def _parse_yaml(path: str, _mtime_ns: int) -> dict:
+    """
+    Parses a .yaml file with YAML_LOADER.
+    Memoized on the file's modification time, so an edited file is parsed again.
+    The returned dict is shared between calls and must not be mutated,
+    so mutable values are copied into the config objects.
+    """
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=YAML_LOADER)
+
+def _load_yaml(file_path: Path) -> dict:
+    """Returns the parsed contents of a .yaml file, reusing the previous parse if the file is unchanged."""
+    resolved = file_path.resolve()
+    return _parse_yaml(str(resolved), resolved.stat().st_mtime_ns)
+
 def load_project_config(file_path: Path) -> ProjectConfig:
     """Loads the project configuration from the .yaml file."""
-    with file_path.open('r') as f:
-        data = yaml.safe_load(f)
+    data = _load_yaml(file_path)
 
     path_config = PathConfig(oauth_credentials=Path(data['paths']['oauth_credentials']).expanduser())
     sheet_config = SheetNamesConfig(**data['sheet'])
-    map_config = MapConfig(**data['map'])
+    # A tuple, so the shared parse is not exposed and the config stays hashable
+    map_config = MapConfig(places=tuple(data['map']['places']), granularity=data['map']['granularity'])
     place_columns = PlaceColumns(**data['place_columns'])
     point_columns = PointColumns(**data['point_columns'])
     direction_columns = DirectionColumns(**data['direction_columns'])
@@ -135,8 +135,7 @@ def load_project_config(file_path: Path) -> ProjectConfig:
 
 def load_sheet_config(file_path: Path) -> GoogleSheetConfig:
     """Loads the Google sheets configuration .yaml file"""
-    with file_path.open('r') as f:
-        data = yaml.safe_load(f)
+    data = _load_yaml(file_path)
     gid = GoogleIds(**data['gid'])
     config = GoogleSheetConfig(id=data['id'], gid=gid)
     return config
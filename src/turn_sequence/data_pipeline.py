@@ -1,4 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
 import pandas as pd
 import pygsheets
@@ -8,6 +12,23 @@ from turn_sequence.map_model import MapModel
 from turn_sequence.config import load_project_config, ProjectConfig
 from turn_sequence import utils
 
+# Number of places processed concurrently. Each place also runs its own pool of API requests.
+MAX_PLACE_WORKERS = 3
+
+@lru_cache(maxsize=4)
+def _authorize(service_file: Path) -> pygsheets.client.Client:
+    """
+    Authorizes a pygsheets client from a service account file.
+    Cached per credentials file, so the key file is parsed and the token is fetched once per process.
+    The client refreshes its own token when it expires.
+    """
+    return pygsheets.authorize(service_file=service_file)
+
+def _raise_batch_error(_request_id: str, _response: dict, exception: Exception) -> None:
+    """Batch request callback that raises the first failed request's error instead of dropping it."""
+    if exception is not None:
+        raise exception
+
 def get_gsheet(config: ProjectConfig,
                email: str=None,
                publish: bool=True,
@@ -20,19 +41,13 @@ def get_gsheet(config: ProjectConfig,
         publish (optional): Make the data public to anyone with the url.
         reset (optional): Reset the spreadsheet
     """
-    gc = pygsheets.authorize(service_file=config.path.oauth_credentials)
+    gc = _authorize(config.path.oauth_credentials)
 
     try:
         # Try to open an existing spreadsheet
         spreadsheet = gc.open(config.sheet.name)
         if reset:
             print("Resetting spreadsheet worksheets...")
-            # Iterate over a copy of the worksheet list to delete them safely.
-            for ws in spreadsheet.worksheets():
-                spreadsheet.del_worksheet(ws)
-            # Google Sheets requires at least one worksheet in the spreadsheet so clear the last one
-            remaining_ws = spreadsheet.worksheets()[0]
-            remaining_ws.clear()
             _init_sheet(spreadsheet, config)
         else:
             print("Opening spreadsheet...")
@@ -43,92 +58,289 @@ def get_gsheet(config: ProjectConfig,
         spreadsheet = gc.create(config.sheet.name)
         _init_sheet(spreadsheet, config)
 
+    # Only add permissions that are missing, so reruns do not repeat Drive writes
+    drive = spreadsheet.client.drive.service
+    permissions = drive.permissions().list(
+        fileId=spreadsheet.id, fields="permissions(type,role,emailAddress)"
+    ).execute().get("permissions", [])
+    editors = {
+        permission.get("emailAddress", "").lower()
+        for permission in permissions
+        if permission["role"] in ("owner", "writer")
+    }
+    is_public = any(permission["type"] == "anyone" for permission in permissions)
+
+    share_requests = []
     # Optionally share the spreadsheet to access from personal email
-    if email is not None:
+    if email is not None and email.lower() not in editors:
         print(f"Sharing spreadsheet to email: {email}")
-        spreadsheet.share(email, role='writer', emailMessage="Here is the Turning Sequence data spreadsheet!")
-    if publish:
+        share_requests.append(drive.permissions().create(
+            fileId=spreadsheet.id,
+            body={"type": "user", "role": "writer", "emailAddress": email},
+            emailMessage="Here is the Turning Sequence data spreadsheet!"
+        ))
+    if publish and not is_public:
         # Make spreadsheet public with read only access
-        spreadsheet.share('', role='reader', type='anyone')
+        share_requests.append(drive.permissions().create(
+            fileId=spreadsheet.id,
+            body={"type": "anyone", "role": "reader"}
+        ))
+    if share_requests:
+        # Send all shares as one multipart batch request
+        batch = drive.new_batch_http_request(callback=_raise_batch_error)
+        for request in share_requests:
+            batch.add(request)
+        batch.execute()
 
     print(f"Spreadsheet URL: {spreadsheet.url}")
 
     return spreadsheet
 
 def _init_sheet(spreadsheet: Spreadsheet, config: ProjectConfig) -> None:
-    """Initializes the spreadsheet with the proper worksheet names and headers."""
-    if spreadsheet.worksheets():
-        # Case when the spreradsheet is created form scratch
-        place_ws = spreadsheet.worksheets()[0]
-        place_ws.title = config.sheet.place_worksheet
-    else:
-        # Case when the spreadsheet is reset
-        place_ws = spreadsheet.add_worksheet(config.sheet.place_worksheet)
-    point_ws = spreadsheet.add_worksheet(config.sheet.point_worksheet)
-    directions_ws = spreadsheet.add_worksheet(config.sheet.directions_worksheet)
+    """
+    Initializes the spreadsheet with the proper worksheet names and headers.
+    Any existing worksheets and data are removed.
+    """
+    worksheets = spreadsheet.worksheets(force_fetch=True)
+    # Google Sheets requires at least one worksheet in the spreadsheet,
+    # so the first one is cleared and reused for places and the rest are deleted.
+    # Requests in a batch are applied in order, so titles are free before they are reused.
+    place_ws = worksheets[0]
+    requests = [{"deleteSheet": {"sheetId": ws.id}} for ws in worksheets[1:]]
+    requests += [
+        {
+            "updateSheetProperties": {
+                "properties": {"sheetId": place_ws.id, "title": config.sheet.place_worksheet},
+                "fields": "title"
+            }
+        },
+        {"updateCells": {"range": {"sheetId": place_ws.id}, "fields": "userEnteredValue"}},
+        {"addSheet": {"properties": {"title": config.sheet.point_worksheet}}},
+        {"addSheet": {"properties": {"title": config.sheet.directions_worksheet}}}
+    ]
+    service = spreadsheet.client.sheet.service
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet.id, body={"requests": requests}).execute()
+    # Refresh pygsheets' cached worksheet list after the structural changes
+    spreadsheet.worksheets(force_fetch=True)
 
-    # Add headers
-    place_ws.insert_rows(row=0, number=1, values=[list(config.place_columns)])
-    point_ws.insert_rows(row=0, number=1, values=[list(config.point_columns)])
-    directions_ws.insert_rows(row=0, number=1, values=[list(config.direction_columns)])
+    # Add headers to all three worksheets in a single request
+    headers = [
+        (config.sheet.place_worksheet, config.place_columns),
+        (config.sheet.point_worksheet, config.point_columns),
+        (config.sheet.directions_worksheet, config.direction_columns)
+    ]
+    body = {
+        "valueInputOption": "RAW",
+        "data": [{"range": f"'{title}'!A1", "values": [columns.as_tuple()]} for title, columns in headers]
+    }
+    service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet.id, body=body).execute()
 
-def add_map_model_to_gsheet(map_model: MapModel, spreadsheet: Spreadsheet, config: ProjectConfig) -> None:
+def _batch_get_values(spreadsheet: Spreadsheet, ranges: list[str], major_dimension: str = "ROWS") -> list[list[list[str]]]:
+    """
+    Reads several ranges in one request.
+    Returns the grid of values of each range in order, without trailing empty rows or columns.
+    """
+    response = spreadsheet.client.sheet.service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet.id,
+        ranges=ranges,
+        majorDimension=major_dimension
+    ).execute()
+    return [value_range.get("values", []) for value_range in response["valueRanges"]]
+
+def _first_line(grid: list[list[str]]) -> list[str]:
+    """Returns the first row, or column if read column major, of a grid of values."""
+    return grid[0] if grid else []
+
+def _get_row_counts(spreadsheet: Spreadsheet) -> dict[int, int]:
+    """Returns the number of rows in the grid of each worksheet, keyed by sheet id."""
+    response = spreadsheet.client.sheet.service.spreadsheets().get(
+        spreadsheetId=spreadsheet.id,
+        fields="sheets(properties(sheetId,gridProperties(rowCount)))"
+    ).execute()
+    return {
+        sheet["properties"]["sheetId"]: sheet["properties"]["gridProperties"]["rowCount"]
+        for sheet in response["sheets"]
+    }
+
+@dataclass
+class WorksheetState:
+    """A worksheet with its header, the first empty row below its data, and the number of rows in its grid."""
+    worksheet: Worksheet
+    header: list[str]
+    next_row: int
+    row_count: int
+
+@dataclass
+class PushContext:
+    """
+    Spreadsheet state shared by every push in a run.
+    Read from Google Sheets once and kept up to date locally after each push,
+    so pushing a place does not re-read the worksheets.
+    """
+    places: WorksheetState
+    points: WorksheetState
+    directions: WorksheetState
+    existing_place_ids: set[str]
+    next_point_id: int
+    next_direction_id: int
+
+def read_push_context(spreadsheet: Spreadsheet, config: ProjectConfig) -> PushContext:
+    """Reads the worksheets, headers, and existing ids needed to push map models."""
+    # Resolve all three worksheets from one worksheet listing
+    worksheets_by_title = {ws.title: ws for ws in spreadsheet.worksheets()}
+    worksheets = (
+        worksheets_by_title[config.sheet.place_worksheet],
+        worksheets_by_title[config.sheet.point_worksheet],
+        worksheets_by_title[config.sheet.directions_worksheet]
+    )
+    id_columns = (config.place_columns.id, config.point_columns.id, config.direction_columns.id)
+
+    # Read all headers in one request, then all id columns in a second one
+    headers = [_first_line(grid) for grid in _batch_get_values(spreadsheet, [f"'{ws.title}'!1:1" for ws in worksheets])]
+    id_ranges = []
+    for ws, header, id_column in zip(worksheets, headers, id_columns):
+        id_letter = utils.get_column_letter(header.index(id_column) + 1)
+        id_ranges.append(f"'{ws.title}'!{id_letter}:{id_letter}")
+    id_grids = _batch_get_values(spreadsheet, id_ranges, major_dimension="COLUMNS")
+    place_ids, point_ids, direction_ids = (_first_line(grid) for grid in id_grids)
+    row_counts = _get_row_counts(spreadsheet)
+
+    # Every data row has an id, so the id column's length is the last filled row
+    places, points, directions = (
+        WorksheetState(ws, header, len(ids) + 1, row_counts[ws.id])
+        for ws, header, ids in zip(worksheets, headers, (place_ids, point_ids, direction_ids))
+    )
+    # Skip headers. Ids are whole numbers, so new ids continue from the integer maximum.
+    return PushContext(
+        places=places,
+        points=points,
+        directions=directions,
+        existing_place_ids=set(place_ids[1:]),
+        next_point_id=int(utils.get_max_numeric_value(point_ids[1:])) + 1,
+        next_direction_id=int(utils.get_max_numeric_value(direction_ids[1:])) + 1
+    )
+
+def add_map_model_to_gsheet(map_model: MapModel,
+                            spreadsheet: Spreadsheet,
+                            config: ProjectConfig,
+                            context: PushContext = None) -> None:
     """
     Push all data from the Place, PlacePoints, and Directions dataframes
     from MapModel to Google Sheets.
 
     - Checks if a row with the same unique place id already exists. If it does, do not push that dataframe.
+    - context is read from the spreadsheet if not given, and is updated with the pushed rows.
     """
     print(f"Pushing {map_model.place.display_name} to spreadhseet...")
+    if context is None:
+        context = read_push_context(spreadsheet, config)
+
     ### Add place to sheet ##
-    place_worksheet = spreadsheet.worksheet('title', config.sheet.place_worksheet)
     place_id = map_model.place.id
-
-    place_id_idx = utils.get_column_index_from_name(place_worksheet, config.place_columns.id)
-    # Get id column values. Skip header.
-    existing_place_ids = place_worksheet.get_col(place_id_idx, include_tailing_empty=False)[1:]
-    if str(place_id) in existing_place_ids:
+    if str(place_id) in context.existing_place_ids:
         print(f"Place {map_model.place.display_name} with id {place_id} already exists. Skipping insertion into place worksheet.")
     else:
-        add_df_to_worksheet(map_model.place.df, place_worksheet)
+        _push_df(map_model.place.df, context.places)
+        context.existing_place_ids.add(str(place_id))
 
     ### Add points to sheet ###
-    point_worksheet = spreadsheet.worksheet('title', config.sheet.point_worksheet)
-    max_existing_point_id = utils.get_max_value_from_worksheet_column(point_worksheet, config.point_columns.id)
-    point_df = map_model.points.df.copy()
-    # Add maximum exiting point id in worksheet to all point ids to ensure uniqueness
-    point_df.loc[:, config.point_columns.id] += max_existing_point_id + 1
-    add_df_to_worksheet(point_df, point_worksheet)
+    point_id_offset = context.next_point_id
+    points = map_model.points.df
+    # Add maximum exiting point id in worksheet to all point ids to ensure uniqueness.
+    # assign copies only the offset column, not the whole dataframe.
+    point_df = points.assign(**{
+        config.point_columns.id: points[config.point_columns.id].to_numpy() + point_id_offset
+    })
+    _push_df(point_df, context.points)
+    context.next_point_id = int(point_df[config.point_columns.id].max()) + 1
 
     ### Add directions to sheet ###
-    directions_worksheet = spreadsheet.worksheet('title', config.sheet.directions_worksheet)
-    direction_df = map_model.directions.df.copy()
-    # Add maximum exiting point id in work sheet to all foreign key columns to point ids for consistency
-    point_foreign_key_columns = [config.direction_columns.origin_id, config.direction_columns.destination_id]
-    direction_df.loc[:, point_foreign_key_columns] += max_existing_point_id + 1
-    # Add maximum existing direction id in worksheet to all direction ids to ensure uniqueness
-    max_existing_direction_id = utils.get_max_value_from_worksheet_column(directions_worksheet, config.direction_columns.id)
-    direction_df.loc[:, config.direction_columns.id] += max_existing_direction_id + 1
-    add_df_to_worksheet(direction_df, directions_worksheet)
-
-def add_df_to_worksheet(df: pd.DataFrame, worksheet: Worksheet) -> None:
+    directions = map_model.directions.df
+    offsets = {
+        # Add maximum exiting point id in work sheet to all foreign key columns to point ids for consistency
+        config.direction_columns.origin_id: point_id_offset,
+        config.direction_columns.destination_id: point_id_offset,
+        # Add maximum existing direction id in worksheet to all direction ids to ensure uniqueness
+        config.direction_columns.id: context.next_direction_id
+    }
+    direction_df = directions.assign(**{
+        column: directions[column].to_numpy() + offset for column, offset in offsets.items()
+    })
+    _push_df(direction_df, context.directions)
+    context.next_direction_id = int(direction_df[config.direction_columns.id].max()) + 1
+
+def _push_df(df: pd.DataFrame, state: WorksheetState) -> None:
+    """Appends df below the data in a worksheet and advances its next row and row count."""
+    state.row_count = add_df_to_worksheet(df, state.worksheet, state.header, state.next_row, state.row_count)
+    state.next_row += len(df)
+
+def add_df_to_worksheet(df: pd.DataFrame,
+                        worksheet: Worksheet,
+                        header: list[str] = None,
+                        start_row: int = None,
+                        row_count: int = None) -> int:
     """
     Push dataframe to worksheet.
-    Ensures there are enough rows in the spreadsheet, and appends the row if needed.
+    Ensures there are enough rows in the spreadsheet, and appends the rows if needed.
+    header, start_row, and row_count are read from the worksheet unless the caller already has them.
+    Returns the number of rows in the worksheet after the push.
     """
-    header = worksheet.get_row(1, include_tailing_empty=False)
+    if header is None or start_row is None:
+        # Read the header row and the first column in one request
+        header_grid, first_column_grid = _batch_get_values(
+            worksheet.spreadsheet,
+            [f"'{worksheet.title}'!1:1", f"'{worksheet.title}'!A:A"]
+        )
+        header = _first_line(header_grid)
+        # Trailing empty rows are not returned, so this is the last filled row
+        start_row = len(first_column_grid) + 1
+    if row_count is None:
+        row_count = _get_row_counts(worksheet.spreadsheet)[worksheet.id]
 
     # Reorder the DataFrame columns to match the sheet header
     df = df[header]
 
-    dummy_column = worksheet.get_col(1, include_tailing_empty=False)
-    start_row = len(dummy_column) + 1
+    # Grow the worksheet if needed and paste the rows in a single batchUpdate
+    end_row = start_row + len(df) - 1
+    requests = []
+    if end_row > row_count:
+        requests.append({
+            "appendDimension": {"sheetId": worksheet.id, "dimension": "ROWS", "length": end_row - row_count}
+        })
+    requests.append({
+        "pasteData": {
+            "coordinate": {"sheetId": worksheet.id, "rowIndex": start_row - 1, "columnIndex": 0},
+            # Tab separated since list values such as "['LR', 'RR']" contain commas
+            "data": df.to_csv(sep="\t", header=False, index=False, lineterminator="\n").rstrip("\n"),
+            "delimiter": "\t",
+            "type": "PASTE_NORMAL"
+        }
+    })
+    worksheet.client.sheet.service.spreadsheets().batchUpdate(
+        spreadsheetId=worksheet.spreadsheet.id, body={"requests": requests}
+    ).execute()
+    return max(row_count, end_row)
 
-    # Add rows to worksheet if needed to ensure data gets inserted
-    if start_row > worksheet.rows:
-        worksheet.add_rows(start_row - worksheet.rows)
+def _process_place(place_name: str,
+                   spreadsheet: Spreadsheet,
+                   config: ProjectConfig,
+                   api_key: str,
+                   context: PushContext,
+                   push_lock: threading.Lock) -> None:
+    """Builds the map model for a place and pushes it to the spreadsheet."""
+    try:
+        model = MapModel(place_name, config, api_key=api_key)
 
-    worksheet.set_dataframe(df, (start_row, 1), copy_head=False)
+        if len(model.directions) > 0:
+            # Pushes read and advance the shared context, so they must not interleave
+            with push_lock:
+                add_map_model_to_gsheet(model, spreadsheet, config, context)
+    except TypeError as e:
+        # Skip if geocode not successful
+        print(f"Geocode not successful: {e}")
+    except ValueError as e:
+        # Skip places with no data, no grid points, or no points that snap to a road
+        print(f"Skipping {place_name}: {e}")
 
 def main():
     """Main access point to the script."""
@@ -141,16 +353,16 @@ def main():
 
     spreadsheet = get_gsheet(config, email=email, publish=True, reset=False)
 
-    for place_name in config.map_.places:
-        api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-        try:
-            model = MapModel(place_name, config, api_key=api_key)
-
-            if len(model.directions) > 0:
-                add_map_model_to_gsheet(model, spreadsheet, config)
-        except TypeError as e:
-            # Skip if geocode not successful
-            print(f"Geocode not successful: {e}")
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    # Read once; pushes keep it up to date
+    context = read_push_context(spreadsheet, config)
+    push_lock = threading.Lock()
+    # Places are independent and network bound, so their models are built concurrently
+    with ThreadPoolExecutor(max_workers=MAX_PLACE_WORKERS) as executor:
+        list(executor.map(
+            lambda place_name: _process_place(place_name, spreadsheet, config, api_key, context, push_lock),
+            config.map_.places
+        ))
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,73 @@
 """
 Contains model for map data.
 """
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
 import random
-import osmnx as ox
 import requests
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point, Polygon
+import shapely
+from shapely.geometry import Polygon
 from turn_sequence import utils
 from turn_sequence.config import ProjectConfig, PlaceColumns, PointColumns, DirectionColumns
 
+# Maximum number of points accepted by a single Google Roads API request
+SNAP_BATCH_SIZE = 100
+# Maximum number of concurrent Google API requests
+MAX_WORKERS = 5
+
+# Default per-project quotas, shared by all threads so concurrent requests stay under them.
+# 429 responses that still get through are retried with backoff by utils.SESSION.
+ROADS_RATE_LIMITER = utils.RateLimiter(requests_per_minute=30000)
+ROUTES_RATE_LIMITER = utils.RateLimiter(requests_per_minute=3000)
+
+# On-disk response caches, each opened once and shared by every place and thread
+ROADS_CACHE_PATH = utils.CACHE_DIR / "roads.sqlite"
+ROUTES_CACHE_PATH = utils.CACHE_DIR / "routes.sqlite"
+
+def snap_to_roads(lons: np.ndarray, lats: np.ndarray, api_key: str,
+                  session: requests.Session = utils.SESSION,
+                  cache: utils.ResponseCache | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Snaps up to SNAP_BATCH_SIZE points to the nearest road in a single request.
+    Returns longitudes and latitudes aligned with the inputs, NaN where no road is found.
+    Uses nearestRoads rather than snapToRoads since the points are independent,
+    not a continuous path.
+    If cache is given, responses are read from and stored in it.
+    """
+    base_url = "https://roads.googleapis.com/v1/nearestRoads"
+    points = "|".join(f"{lat},{lon}" for lon, lat in zip(lons, lats))
+
+    # The api key is left out of the key so cached responses survive key rotation
+    cache_request = {"url": base_url, "points": points}
+    data = cache.get(cache_request) if cache is not None else None
+    if data is None:
+        params = {
+            "points": points,
+            "key": api_key
+        }
+        ROADS_RATE_LIMITER.acquire()
+        response = session.get(base_url, params=params, timeout=15)
+        response.raise_for_status()
+        data = response.json()
+        utils.check_for_errors(data)
+        if cache is not None:
+            cache.set(cache_request, data)
+
+    # Points with no road within ~50m have no entry in 'snappedPoints'
+    snapped_lons = np.full(lons.size, np.nan)
+    snapped_lats = np.full(lats.size, np.nan)
+    for snapped_point in data.get("snappedPoints", []):
+        index = snapped_point["originalIndex"]
+        # Two-way roads return one entry per direction; keep the first
+        if not np.isnan(snapped_lons[index]):
+            continue
+        snapped_location = snapped_point["location"]
+        snapped_lons[index] = snapped_location["longitude"]
+        snapped_lats[index] = snapped_location["latitude"]
+    return snapped_lons, snapped_lats
+
 class Place:
     """
     Data at the place level, e.g. in a city
@@ -17,7 +76,7 @@ class Place:
     def __init__(self, name: str, place_columns: PlaceColumns):
         self.name: str = name
 
-        gdf = ox.geocode_to_gdf(self.name)
+        gdf = utils.cached_geocode_to_gdf(self.name)
         if gdf.empty:
             raise ValueError(f"Place data not returned for {self.name}")
 
@@ -28,6 +87,8 @@ class Place:
         self.lat_max: float = gdf.loc[0,'bbox_north']
         self.lon_max: float = gdf.loc[0,'bbox_east']
         self.polygon: Polygon = gdf.loc[0,'geometry']
+        # Build the GEOS spatial index once so repeated point-in-polygon tests reuse it
+        shapely.prepare(self.polygon)
         self.df: pd.DataFrame = self._to_df(place_columns)
 
     def __str__(self):
@@ -51,18 +112,20 @@ class PlacePoints:
     1) Paritions a place into grid points
     2) Splits bounding box into granularity x granularity points
     3) Rejects points that are not within the place
+    Coordinates are stored as parallel longitude and latitude arrays.
+    Snapped coordinates are NaN where no road was found.
     """
     def __init__(self, place: Place, map_granularity: int, point_columns: PointColumns, api_key: str = None):
         # Get a GeoDataFrame of the boundary polygon
         self.place: Place = place
-        self.grid_points: list[Point] = self._generate_grid_points(map_granularity)
-        if not self.grid_points:
+        self.grid_lons, self.grid_lats = self._generate_grid_points(map_granularity)
+        if self.grid_lons.size == 0:
             raise ValueError(f"No points found in: {self.place}")
         if api_key is not None:
-            self.snapped_points: list[Point] = self._snap_grid_points_to_road(api_key)
-
+            self.snapped_lons, self.snapped_lats = self._snap_grid_points_to_road(api_key)
         else:
-            self.snapped_points = None
+            self.snapped_lons = None
+            self.snapped_lats = None
         self.df = self._to_df(point_columns)
 
     def __len__(self):
@@ -70,93 +133,60 @@ class PlacePoints:
 
     def _to_df(self, point_columns: PointColumns) -> pd.DataFrame:
         """Converts data to dataframe."""
-        ids = tuple(range(len(self.grid_points)))
-        grid_lat = [grid_point.y for grid_point in self.grid_points]
-        grid_lon = [grid_point.x for grid_point in self.grid_points]
-        if self.snapped_points is not None:
-            snapped_lat = [snapped_point.y if snapped_point is not None else None for snapped_point in self.snapped_points]
-            snapped_lon = [snapped_point.x if snapped_point is not None else None for snapped_point in self.snapped_points]
-        else:
-            snapped_lat = None
-            snapped_lon = None
         data = {
-            point_columns.id: ids,
+            point_columns.id: np.arange(self.grid_lons.size),
             point_columns.place_id: self.place.id,
-            point_columns.grid_lat: grid_lat,
-            point_columns.grid_lon: grid_lon,
-            point_columns.snapped_lat: snapped_lat,
-            point_columns.snapped_lon: snapped_lon
+            point_columns.grid_lat: self.grid_lats,
+            point_columns.grid_lon: self.grid_lons,
+            point_columns.snapped_lat: self.snapped_lats,
+            point_columns.snapped_lon: self.snapped_lons
         }
         return pd.DataFrame(data)
 
-    def _generate_grid_points(self, num: int) -> list[Point]:
+    def _generate_grid_points(self, num: int) -> tuple[np.ndarray, np.ndarray]:
         """
         Partitions the place into grid points, evenly spaced along lat and lon.
-        Iterates over points in bounding box.
+        Builds a (num + 1) x (num + 1) grid over the bounding box.
         If they are not in the polygon bounding the Place, they are tossed.
-        Returns a list of points spaced dx, dy apart inside the polygon.
+        Returns the longitudes and latitudes of the grid points inside the polygon.
         """
         print(f"Partioning {self.place.display_name} into evenly spaced points...")
         minx, miny, maxx, maxy = self.place.polygon.bounds
-        dx = (maxx - minx)/num
-        dy = (maxy - miny)/num
-        points = []
-        
-        # Move through the bounding box in increments of dx, dy
-        x = minx
-        while x <= maxx:
-            y = miny
-            while y <= maxy:
-                candidate = Point(x, y)
-                if self.place.polygon.contains(candidate):
-                    points.append(candidate)
-                y += dy
-            x += dx
-
-        return points
-
-    def _snap_grid_points_to_road(self, api_key: str) -> list[Point]:
+
+        # num + 1 evenly spaced values per axis, endpoints included
+        xs = np.linspace(minx, maxx, num + 1)
+        ys = np.linspace(miny, maxy, num + 1)
+        grid_x, grid_y = np.meshgrid(xs, ys, indexing='ij')
+        grid_x = grid_x.ravel()
+        grid_y = grid_y.ravel()
+
+        # Single bulk point-in-polygon test instead of one GEOS call per point
+        mask = shapely.contains_xy(self.place.polygon, grid_x, grid_y)
+        return grid_x[mask], grid_y[mask]
+
+    def _snap_grid_points_to_road(self, api_key: str) -> tuple[np.ndarray, np.ndarray]:
         """
         Snaps all points to the road.
         Ensures each point is drivable, e.g., not in the water.
+        Points are sent to the Roads API in concurrent batches of SNAP_BATCH_SIZE.
+        Responses are cached on disk, so rerunning a place does not trigger new API calls.
+        Returns the snapped longitudes and latitudes, NaN where no road is found.
         """
-        snapped_points = []
-        for point in self.grid_points:
-            snapped_point = self._snap_to_road(point, api_key)
-            snapped_points.append(snapped_point)
-        # If we have iterated through all points and have not found num_points valid points...
-        if not snapped_points:
+        batches = [
+            (self.grid_lons[start:start + SNAP_BATCH_SIZE], self.grid_lats[start:start + SNAP_BATCH_SIZE])
+            for start in range(0, self.grid_lons.size, SNAP_BATCH_SIZE)
+        ]
+        # Requests are network bound, so issue them concurrently. map preserves batch order.
+        cache = utils.get_response_cache(ROADS_CACHE_PATH)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            snapped_batches = list(executor.map(lambda batch: snap_to_roads(*batch, api_key, cache=cache), batches))
+        snapped_lons = np.concatenate([lons for lons, _ in snapped_batches])
+        snapped_lats = np.concatenate([lats for _, lats in snapped_batches])
+        # Unsnapped points are NaN, so no road was found if every point is NaN
+        if np.isnan(snapped_lons).all():
             raise ValueError(f"Could not find any valid points for {self.place}")
 
-        return snapped_points
-
-    def _snap_to_road(self, point: Point, api_key) -> Point:
-        """
-        Returns a (lat, lng) snapped to the nearest road, or None if no road is found.
-        """
-        lon = point.x
-        lat = point.y
-        base_url = "https://roads.googleapis.com/v1/snapToRoads"
-        params = {
-            "path": f"{lat},{lon}",
-            "interpolate": "false",
-            "key": api_key
-        }
-        response = requests.get(base_url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        utils.check_for_errors(data)
-
-        # 'snappedPoints' will be empty if there's no road within ~50m
-        snapped_points = data.get("snappedPoints", [])
-        if not snapped_points:
-            return None  # Means no road found near your point
-
-        # The first snapped point is the nearest road location
-        snapped_location = snapped_points[0]["location"]
-        snapped_lat = snapped_location["latitude"]
-        snapped_lon = snapped_location["longitude"]
-        return Point(snapped_lon, snapped_lat)
+        return snapped_lons, snapped_lats
 
 class Directions:
     """
@@ -173,90 +203,109 @@ class Directions:
                  api_key: str,
                  choose_random: int = None):
         self.points = points
+        self._route_cache = utils.get_response_cache(ROUTES_CACHE_PATH)
+        # The same url and headers are sent with every route request
+        self._url = "https://routes.googleapis.com/directions/v2:computeRoutes"
+        self._headers = {
+            "Content-Type": "application/json; charset=UTF-8",
+            "X-Goog-Api-Key": api_key,
+            "X-Goog-FieldMask": (
+                "routes.distanceMeters,"
+                "routes.legs.steps.navigationInstruction.maneuver"
+            )
+        }
+        # Only the snapped grid points get routed, as plain (lon, lat) tuples
+        snapped_ids = np.flatnonzero(~np.isnan(self.points.snapped_lons))
         indexed_points = [
-            (grid_id, snapped_point)
-            for grid_id, snapped_point in enumerate(self.points.snapped_points)
-            if snapped_point is not None
+            (int(grid_id), (float(self.points.snapped_lons[grid_id]), float(self.points.snapped_lats[grid_id])))
+            for grid_id in snapped_ids
         ]
         if choose_random is not None:
-            random.shuffle(indexed_points)
-            indexed_points = indexed_points[:choose_random]
-        self.df = self._to_df(indexed_points, direction_columns, api_key)
+            # Draw without shuffling the whole list
+            indexed_points = random.sample(indexed_points, min(choose_random, len(indexed_points)))
+        self.df = self._to_df(indexed_points, direction_columns)
 
     def __len__(self):
         return len(self.df)
 
-    def _get_route_data(self, origin: Point, destination: Point, api_key: str):
+    def _get_route_data(self, origin: tuple[float, float], destination: tuple[float, float]):
         """
-        Given an origin and desitination as Point objects,
+        Given an origin and desitination as (lon, lat) tuples,
         return the route data from Google Routes API.
+        Responses are cached on disk, so repeated pairs do not trigger a new API call.
         """
         if origin == destination:
             raise ValueError("Origin and destination must be different.")
 
-        url = "https://routes.googleapis.com/directions/v2:computeRoutes"
-        headers = {
-            "Content-Type": "application/json; charset=UTF-8",
-            "X-Goog-Api-Key": api_key,
-            "X-Goog-FieldMask": (
-                "routes.distanceMeters,"
-                "routes.legs.steps.navigationInstruction.maneuver"
-            )
-        }
-
         body = utils.format_route_body(origin, destination)
 
-        response = requests.post(url, headers=headers, json=body, timeout=15)
+        # The field mask is part of the key so cached responses always contain the requested fields
+        cache_request = {"url": self._url, "fields": self._headers["X-Goog-FieldMask"], "body": body}
+        route_data = self._route_cache.get(cache_request)
+        if route_data is not None:
+            return route_data
+
+        ROUTES_RATE_LIMITER.acquire()
+        response = utils.SESSION.post(self._url, headers=self._headers, json=body, timeout=15)
         response.raise_for_status()
         route_data = response.json()
         utils.check_for_errors(route_data)
+        self._route_cache.set(cache_request, route_data)
         return route_data
 
-    def _to_df(self, indexed_points: list[tuple[int, Point]], direction_columns: DirectionColumns, api_key: str) -> pd.DataFrame:
+    def _to_df(self, indexed_points: list[tuple[int, tuple[float, float]]], direction_columns: DirectionColumns) -> pd.DataFrame:
         """
         Finds and processes pairwise directions for all pairwise points in indexed_points.
-        Each entry is a (grid_id, Point) pair; grid_id is the PlacePoints id for the foreign-key columns.
+        Each entry is a (grid_id, (lon, lat)) pair; grid_id is the PlacePoints id for the foreign-key columns.
         Uses Google Routes API to find directions.
         returns data formatted as dataframe.
         WARNING: if there are n points in indexed_points, this functions makes O(n^2) API calls to find all pairwise directions.
         """
-        origin_id_col = []
-        destination_id_col = []
+        # permutations skips each point paired with itself. Distinct grid points can still
+        # snap to the same road location, and there is no route between those.
+        pairs = [
+            (origin_id, origin, destination_id, destination)
+            for (origin_id, origin), (destination_id, destination) in permutations(indexed_points, 2)
+            if origin != destination
+        ]
+        # Sized for every pair and trimmed to the routes found afterwards
+        origin_id_col = np.empty(len(pairs), dtype=np.int64)
+        destination_id_col = np.empty(len(pairs), dtype=np.int64)
+        distance_km_col = np.full(len(pairs), np.nan)
         raw_directions_col = []
         lr_directions_col = []
         direction_pairs_col = []
-        distance_km_col = []
 
-        for origin_id, origin in indexed_points:
-            for destination_id, destination in indexed_points:
-                if origin == destination:
-                    continue
-                route_data = self._get_route_data(origin, destination, api_key)
+        # Requests are network bound, so issue them concurrently. map preserves pair order.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            all_route_data = executor.map(
+                lambda pair: self._get_route_data(pair[1], pair[3]), pairs
+            )
+            num_routes = 0
+            for (origin_id, _, destination_id, _), route_data in zip(pairs, all_route_data):
                 if not route_data:
                     continue
                 raw_directions = utils.get_maneuvers_from_routes(route_data)
                 lr_directions = utils.get_turns_from_maneuvers(raw_directions)
                 direction_pairs = utils.get_double_turns(lr_directions)
 
-                origin_id_col.append(origin_id)
-                destination_id_col.append(destination_id)
+                origin_id_col[num_routes] = origin_id
+                destination_id_col[num_routes] = destination_id
                 raw_directions_col.append(raw_directions)
                 lr_directions_col.append(lr_directions)
                 direction_pairs_col.append(direction_pairs)
-                distance_m = route_data['routes'][0]['distanceMeters']
+                # Missing distances stay NaN
+                distance_m = route_data['routes'][0].get('distanceMeters')
                 if distance_m is not None:
-                    distance_km = distance_m / 1000
-                else:
-                    distance_km = None
-                distance_km_col.append(distance_km)
+                    distance_km_col[num_routes] = distance_m / 1000
+                num_routes += 1
 
-        ids = tuple(range(len(raw_directions_col)))
         data = {
-            direction_columns.id: ids,
-            direction_columns.origin_id: origin_id_col,
-            direction_columns.destination_id: destination_id_col,
+            direction_columns.id: np.arange(num_routes),
+            direction_columns.origin_id: origin_id_col[:num_routes],
+            direction_columns.destination_id: destination_id_col[:num_routes],
             direction_columns.place_id: self.points.place.id,
-            direction_columns.distance_km: distance_km_col,
+            direction_columns.distance_km: distance_km_col[:num_routes],
             direction_columns.raw_directions: raw_directions_col,
             direction_columns.lr_directions: lr_directions_col,
             direction_columns.direction_pairs: direction_pairs_col
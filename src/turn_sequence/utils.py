@@ -1,27 +1,173 @@
 """Utility functions"""
+from functools import lru_cache
+from pathlib import Path
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
 import pandas as pd
-from shapely.geometry import Point
-from pygsheets import Worksheet
+import geopandas as gpd
+import osmnx as ox
+import shapely
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
-def format_route_body(origin: Point, destination: Point) -> dict:
+CACHE_DIR = Path(".cache")
+
+# Keep osmnx's raw HTTP response cache alongside the project's other caches
+ox.settings.use_cache = True
+ox.settings.cache_folder = CACHE_DIR / "osmnx"
+
+# Nominatim allows one request per second. osmnx only spaces requests within a call,
+# so concurrent places geocode one at a time.
+GEOCODE_LOCK = threading.Lock()
+
+# Maps the direction suffix of a Routes API maneuver, e.g. TURN_SLIGHT_LEFT, to a turn
+TURN_DIRECTIONS = {"LEFT": "L", "RIGHT": "R"}
+
+def create_session(pool_maxsize: int = 32) -> requests.Session:
+    """
+    Creates a requests session that keeps HTTPS connections alive between calls
+    and retries rate limited or failed Google API requests with exponential backoff.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Routes API requests are POSTs but safe to repeat
+        allowed_methods=("GET", "POST"),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    # Google APIs only gzip responses for clients whose user agent contains "gzip".
+    # requests already sends Accept-Encoding: gzip and decompresses transparently.
+    session.headers["User-Agent"] = "turn-sequence (gzip)"
+    return session
+
+# Shared by all Google API calls so TLS connections are reused
+SESSION = create_session()
+
+class RateLimiter:
+    """
+    Spaces out calls so at most requests_per_minute start in any minute.
+    Safe to share between threads. Callers block in acquire until their turn.
+    """
+    def __init__(self, requests_per_minute: float):
+        self._interval = 60 / requests_per_minute
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def acquire(self) -> None:
+        """Blocks until the next request may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self._interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+class ResponseCache:
+    """
+    SQLite backed cache of JSON API responses, keyed on a hash of the request.
+    Safe to share between threads.
+    """
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses(key TEXT PRIMARY KEY, response TEXT, ts INTEGER)"
+            )
+
+    @staticmethod
+    def _key(request: dict) -> str:
+        """Hashes a canonical JSON encoding of the request."""
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, request: dict) -> dict | None:
+        """Returns the cached response for request, or None on a cache miss."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key=?", (self._key(request),)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, request: dict, response: dict) -> None:
+        """Stores the response for request."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses(key, response, ts) VALUES (?, ?, ?)",
+                (self._key(request), json.dumps(response), int(time.time()))
+            )
+
+# One ResponseCache, and so one SQLite connection, per cache file for the whole process
+_RESPONSE_CACHES: dict[Path, ResponseCache] = {}
+_RESPONSE_CACHES_LOCK = threading.Lock()
+
+def get_response_cache(path: Path) -> ResponseCache:
+    """Returns the shared ResponseCache for path, opening it on first use."""
+    with _RESPONSE_CACHES_LOCK:
+        if path not in _RESPONSE_CACHES:
+            _RESPONSE_CACHES[path] = ResponseCache(path)
+        return _RESPONSE_CACHES[path]
+
+@lru_cache(maxsize=None)
+def cached_geocode_to_gdf(name: str) -> gpd.GeoDataFrame:
+    """
+    Geocodes a place name with osmnx.
+    Results are memoized in process and persisted under CACHE_DIR so repeated runs
+    do not hit Nominatim for places that were already fetched.
+    The boundary is stored as WKB, which loads much faster than GeoJSON for large polygons.
+    Network geocodes are serialized with GEOCODE_LOCK to respect Nominatim's rate limit.
+    """
+    cache_path = CACHE_DIR / "geocode" / hashlib.sha1(name.encode("utf-8")).hexdigest()
+    attributes_path = cache_path.with_suffix(".json")
+    geometry_path = cache_path.with_suffix(".wkb")
+    if attributes_path.exists() and geometry_path.exists():
+        cached = json.loads(attributes_path.read_text())
+        geometry = shapely.from_wkb(geometry_path.read_bytes())
+        return gpd.GeoDataFrame([cached["attributes"]], geometry=[geometry], crs=cached["crs"])
+
+    with GEOCODE_LOCK:
+        gdf = ox.geocode_to_gdf(name)
+    # A single query string geocodes to a single row
+    if len(gdf) == 1:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        attributes = json.loads(gdf.drop(columns="geometry").iloc[0].to_json())
+        geometry_path.write_bytes(shapely.to_wkb(gdf.loc[0, "geometry"]))
+        attributes_path.write_text(json.dumps({"crs": gdf.crs.to_string(), "attributes": attributes}))
+    return gdf
+
+def format_route_body(origin: tuple[float, float], destination: tuple[float, float]) -> dict:
     """
     Formats post request body for Google Routes API.
-    Point.x is longitude, Point.y is latitude.
+    origin and destination are (longitude, latitude) pairs.
     """
+    origin_lon, origin_lat = origin
+    destination_lon, destination_lat = destination
     body = {
         "origin": {
             "location": {
                 "latLng": {
-                    "latitude": origin.y,
-                    "longitude": origin.x
+                    "latitude": origin_lat,
+                    "longitude": origin_lon
                 }
             }
         },
         "destination": {
             "location": {
                 "latLng": {
-                    "latitude": destination.y,
-                    "longitude": destination.x
+                    "latitude": destination_lat,
+                    "longitude": destination_lon
                 }
             }
         },
@@ -37,21 +183,18 @@ def check_for_errors(maps_data: dict) -> None:
 def get_maneuvers_from_routes(routes: dict) -> list[str]:
     """
     Given the route response from Google Routes API,
-    process response into list of maneuvers.
+    process response into list of maneuvers across all legs of the first route.
     """
     if not routes or not routes.get("routes"):
         return []
     legs = routes["routes"][0].get("legs") or []
-    if not legs:
-        return []
-    steps = legs[0].get("steps") or []
     maneuvers = []
-    for step in steps:
-        if not step:
-            continue
-        instruction = step.get("navigationInstruction")
-        if instruction and "maneuver" in instruction:
-            maneuvers.append(instruction["maneuver"])
+    # Routes with intermediate waypoints have one leg per segment
+    for leg in legs:
+        for step in leg.get("steps") or []:
+            instruction = step.get("navigationInstruction")
+            if instruction and "maneuver" in instruction:
+                maneuvers.append(instruction["maneuver"])
     return maneuvers
 
 def get_turns_from_maneuvers(maneuvers: list[str]) -> list[str]:
@@ -59,13 +202,10 @@ def get_turns_from_maneuvers(maneuvers: list[str]) -> list[str]:
     Given a list of maneuvers,
     Returns sequence of "L" or "R" corresponding to left or right turns.
     """
-    turns = []
-    for m in maneuvers:
-        if "LEFT" in m:
-            turns.append("L")
-        elif "RIGHT" in m:
-            turns.append("R")
-    return turns
+    return [
+        turn for maneuver in maneuvers
+        if (turn := TURN_DIRECTIONS.get(maneuver.rpartition("_")[2])) is not None
+    ]
 
 def get_double_turns(turns: list[str]) -> list[str]:
     """
@@ -76,41 +216,15 @@ def get_double_turns(turns: list[str]) -> list[str]:
         - RL for right then left
         - RR for right then right
     """
-    double_turns = []
-    for index, turn in enumerate(turns[:-1]):
-        t_next = turns[index+1]
-        double_turns.append(turn + t_next)
-    return double_turns
-
-def get_column_index_from_name(worksheet: Worksheet, column_name: str) -> int:
-    """
-    Retrieve the column index for a given header in a pygsheets worksheet.
+    return [turn + next_turn for turn, next_turn in zip(turns, turns[1:])]
 
-    Args:
-        worksheet: The pygsheets worksheet object.
-        column_name: The header string to find.
-
-    Returns:
-        An integer representing the 1-indexed column position of the header,
-        or None if the header is not found.
-    """
-    header = worksheet.get_row(1, include_tailing_empty=False)
-    try:
-        # Convert to 1-indexed
-        column_index = header.index(column_name) + 1
-        return column_index
-    except ValueError:
-        return None
-
-def get_max_value_from_worksheet_column(worksheet: Worksheet, column_name: str) -> float:
+def get_max_numeric_value(values: list[str]) -> float:
     """
-    Gets the maximum value from a worksheet corresponding to a given column name.
-    If there are no numeric values in the column, return 0.
+    Gets the maximum of the values that parse as numbers.
+    If there are no numeric values, return 0.
     """
-    col_index = get_column_index_from_name(worksheet, column_name)
-    col_values = worksheet.get_col(col_index, include_tailing_empty=False)
     numeric_values = []
-    for value in col_values[1:]:
+    for value in values:
         try:
             numeric_values.append(float(value))
         except (ValueError, TypeError):
@@ -119,11 +233,23 @@ def get_max_value_from_worksheet_column(worksheet: Worksheet, column_name: str)
         return 0
     return max(numeric_values)
 
-def get_gsheet_df(sheet_id: str, gid: int) -> pd.DataFrame:
+def get_column_letter(column_index: int) -> str:
+    """Converts a 1-indexed column number to A1 notation, e.g. 28 -> 'AB'."""
+    letters = ""
+    while column_index > 0:
+        column_index, remainder = divmod(column_index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def get_gsheet_df(sheet_id: str, gid: int, converters: dict | None = None) -> pd.DataFrame:
     """
     Reads worksheet correspongin to gid
     from google sheets and returns it as a dataframe.
+    converters maps column names to functions applied to each cell while parsing.
     """
     url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&id={sheet_id}&gid={gid}'
-    df = pd.read_csv(url)
+    # Fetch through the shared session so worksheets of the same sheet reuse one connection
+    response = SESSION.get(url, timeout=30)
+    response.raise_for_status()
+    df = pd.read_csv(io.BytesIO(response.content), engine='c', converters=converters)
     return df
@@ -1,20 +1,26 @@
 """Configuration for tests"""
 from pathlib import Path
+import pandas as pd
 import pytest
-from turn_sequence import config
+from turn_sequence import config, utils
 
-@pytest.fixture(name='config_dir')
+@pytest.fixture(name='config_dir', scope='session')
 def fixture_config_dir() -> Path:
     return Path.cwd() / "config"
 
-@pytest.fixture(name='project_config')
+@pytest.fixture(name='project_config', scope='session')
 def fixture_project_config(config_dir: Path) -> config.ProjectConfig:
     project_config_path = config_dir / "project_config.yaml"
     project_config = config.load_project_config(project_config_path)
     return project_config
 
-@pytest.fixture(name='sheet_config')
+@pytest.fixture(name='sheet_config', scope='session')
 def fixture_sheet_config(config_dir: Path) -> config.GoogleSheetConfig:
     sheet_config_path = config_dir / "sheet_config.yaml"
     sheet_config = config.load_sheet_config(sheet_config_path)
     return sheet_config
+
+@pytest.fixture(name='gsheet_dfs', scope='session')
+def fixture_gsheet_dfs(sheet_config: config.GoogleSheetConfig) -> dict[int, pd.DataFrame]:
+    """Downloads each worksheet once per test session, keyed by gid."""
+    return {gid: utils.get_gsheet_df(sheet_config.id, gid) for gid in sheet_config.gid}
@@ -0,0 +1,102 @@
+"""Tests for analysis.py"""
+import pandas as pd
+import pytest
+from turn_sequence import analysis
+from turn_sequence.config import ProjectConfig, GoogleSheetConfig
+
+def test_alternating_turn_percentages_non_unique_index(project_config: ProjectConfig):
+    column = project_config.direction_columns.direction_pairs
+    directions_df = pd.DataFrame({column: [["LR", "RL"], ["LL", "RR"]]})
+    # Both copies keep the index labels 0 and 1
+    duplicated_df = pd.concat([directions_df, directions_df])
+    percentages = analysis.calculate_alternating_turn_percentage(duplicated_df, project_config.direction_columns)
+    assert percentages == [100.0, 0.0, 100.0, 0.0]
+
+def test_place_statistics_non_unique_index(project_config: ProjectConfig):
+    place_columns = project_config.place_columns
+    direction_columns = project_config.direction_columns
+    places_df = pd.DataFrame({place_columns.id: [1, 2], place_columns.name: ["A", "B"]})
+    directions_df = pd.DataFrame({
+        direction_columns.place_id: [1, 2],
+        direction_columns.direction_pairs: [["LR"], ["LL"]]
+    }, index=[0, 0])
+    stats = analysis.place_alternating_turn_statistics(places_df, directions_df, project_config)
+    assert stats.loc["A", "mean"] == 100.0
+    assert stats.loc["B", "mean"] == 0.0
+    assert stats.loc[analysis.TOTAL_ROW, "count"] == 2
+
+def test_alternating_turn_percentages_skips_paths_without_double_turns(project_config: ProjectConfig):
+    column = project_config.direction_columns.direction_pairs
+    directions_df = pd.DataFrame({column: [[], ["LR", "LL"]]})
+    percentages = analysis.calculate_alternating_turn_percentage(directions_df, project_config.direction_columns)
+    assert percentages == [50.0]
+
+def test_alternating_turn_percentages_invalid_double_turn(project_config: ProjectConfig):
+    column = project_config.direction_columns.direction_pairs
+    directions_df = pd.DataFrame({column: [["LR", "XX"]]})
+    with pytest.raises(ValueError):
+        analysis.calculate_alternating_turn_percentage(directions_df, project_config.direction_columns)
+
+def test_place_statistics_total_row_without_double_turns(project_config: ProjectConfig):
+    place_columns = project_config.place_columns
+    direction_columns = project_config.direction_columns
+    places_df = pd.DataFrame({place_columns.id: [1], place_columns.name: ["A"]})
+    directions_df = pd.DataFrame({
+        direction_columns.place_id: [1],
+        direction_columns.direction_pairs: [[]]
+    })
+    stats = analysis.place_alternating_turn_statistics(places_df, directions_df, project_config)
+    assert "A" not in stats.index
+    assert stats.loc[analysis.TOTAL_ROW, "count"] == 0
+    assert pd.isna(stats.loc[analysis.TOTAL_ROW, "mean"])
+
+@pytest.mark.parametrize("cell, expected", [
+    ("['LR', 'RR']", ["LR", "RR"]),
+    ("[]", []),
+    ("", [])
+])
+def test_parse_list_cell(cell: str, expected: list[str]):
+    assert analysis.parse_list_cell(cell) == expected
+
+@pytest.mark.parametrize("cell", ["[LR, RR]", '["LR", "RR"]', "LR", "['LR', 'RR'"])
+def test_parse_list_cell_malformed(cell: str):
+    with pytest.raises(ValueError):
+        analysis.parse_list_cell(cell)
+
+def test_alternating_turn_percentages_string_cells(project_config: ProjectConfig):
+    column = project_config.direction_columns.direction_pairs
+    directions_df = pd.DataFrame({column: ["['LR', 'LL']", None, "[]"]})
+    percentages = analysis.calculate_alternating_turn_percentage(directions_df, project_config.direction_columns)
+    assert percentages == [50.0]
+
+def test_alternating_turn_percentages_from_gsheet(project_config: ProjectConfig,
+                                                  sheet_config: GoogleSheetConfig,
+                                                  gsheet_dfs: dict[int, pd.DataFrame]):
+    # The directions worksheet as read by utils.get_gsheet_df, with the direction pairs still strings
+    directions_df = gsheet_dfs[sheet_config.gid.directions]
+    percentages = analysis.calculate_alternating_turn_percentage(directions_df, project_config.direction_columns)
+    assert all(0 <= percentage <= 100 for percentage in percentages)
+
+def test_alternating_turn_metric():
+    assert analysis.alternating_turn_metric(["LR", "RL", "LL", "RR"]) == 0.5
+
+def test_alternating_turn_metric_without_double_turns():
+    assert analysis.alternating_turn_metric([]) == 0.0
+
+@pytest.mark.parametrize("double_turns", [["LR", "XX"], ["LR", None]])
+def test_alternating_turn_metric_invalid_double_turn(double_turns: list):
+    with pytest.raises(ValueError):
+        analysis.alternating_turn_metric(double_turns)
+
+def test_place_alternating_turn_percentages(project_config: ProjectConfig):
+    place_columns = project_config.place_columns
+    direction_columns = project_config.direction_columns
+    places_df = pd.DataFrame({place_columns.id: [1, 2, 3], place_columns.name: ["A", "B", "C"]})
+    directions_df = pd.DataFrame({
+        direction_columns.place_id: [1, 2, 1],
+        direction_columns.direction_pairs: [["LR"], ["LL"], ["LL", "RL"]]
+    })
+    assert analysis.place_alternating_turn_percentages("A", places_df, directions_df, project_config) == [100.0, 50.0]
+    assert analysis.place_alternating_turn_percentages("B", places_df, directions_df, project_config) == [0.0]
+    # A place without directions has no percentages
+    assert analysis.place_alternating_turn_percentages("C", places_df, directions_df, project_config) == []
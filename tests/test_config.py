@@ -0,0 +1,24 @@
+"""Tests for config.py"""
+from pathlib import Path
+from turn_sequence import config
+
+def test_project_config_is_immutable_and_hashable(config_dir: Path):
+    project_config_path = config_dir / "project_config.yaml"
+    first = config.load_project_config(project_config_path)
+    second = config.load_project_config(project_config_path)
+    assert isinstance(first.map_.places, tuple)
+    assert first == second
+    assert hash(first) == hash(second)
+
+def test_columns_iterate_in_field_order(project_config: config.ProjectConfig):
+    place_columns = project_config.place_columns
+    assert place_columns.as_tuple() == (
+        place_columns.id,
+        place_columns.name,
+        place_columns.display_name,
+        place_columns.lat_min,
+        place_columns.lat_max,
+        place_columns.lon_min,
+        place_columns.lon_max
+    )
+    assert tuple(project_config.direction_columns) == project_config.direction_columns.as_tuple()
@@ -1,9 +1,143 @@
 """Tests for data_pipeline.py"""
-from turn_sequence import utils
-from turn_sequence.config import GoogleSheetConfig
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from turn_sequence import data_pipeline
+from turn_sequence.config import GoogleSheetConfig, ProjectConfig
 
-def test_get_gsheet_df(sheet_config: GoogleSheetConfig):
+def test_get_gsheet_df(sheet_config: GoogleSheetConfig, gsheet_dfs: dict[int, pd.DataFrame]):
     for gid in sheet_config.gid:
-        df = utils.get_gsheet_df(sheet_config.id, gid)
+        df = gsheet_dfs[gid]
         # Check that columns exist
         assert len(df.columns) > 0
+
+class FakeRequest:
+    """Stands in for a Google API client request."""
+    def __init__(self, response: dict):
+        self._response = response
+
+    def execute(self) -> dict:
+        return self._response
+
+class FakeSpreadsheets:
+    """
+    Stands in for the Sheets API spreadsheets resource and its values resource.
+    Serves fixed grids by A1 range and records batch updates.
+    Method and argument names follow the Sheets API.
+    """
+    def __init__(self, grids: dict[str, list[list[str]]], row_counts: dict[int, int]):
+        self.grids = grids
+        self.row_counts = row_counts
+        self.batch_updates = []
+
+    def values(self) -> "FakeSpreadsheets":
+        return self
+
+    def batchGet(self, spreadsheetId: str, ranges: list[str], majorDimension: str) -> FakeRequest:
+        value_ranges = [{"values": self.grids[a1_range]} if a1_range in self.grids else {} for a1_range in ranges]
+        return FakeRequest({"valueRanges": value_ranges})
+
+    def get(self, spreadsheetId: str, fields: str) -> FakeRequest:
+        sheets = [
+            {"properties": {"sheetId": sheet_id, "gridProperties": {"rowCount": row_count}}}
+            for sheet_id, row_count in self.row_counts.items()
+        ]
+        return FakeRequest({"sheets": sheets})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> FakeRequest:
+        self.batch_updates.append(body)
+        return FakeRequest({})
+
+@pytest.fixture(name='fake_spreadsheet')
+def fixture_fake_spreadsheet(project_config: ProjectConfig) -> tuple[SimpleNamespace, FakeSpreadsheets]:
+    """
+    A spreadsheet with two places, points with ids up to 7, and no directions.
+    The point id column is the second column, B.
+    """
+    place_title = project_config.sheet.place_worksheet
+    point_title = project_config.sheet.point_worksheet
+    directions_title = project_config.sheet.directions_worksheet
+    point_columns = project_config.point_columns
+    point_header = [point_columns.place_id, point_columns.id, point_columns.grid_lat,
+                    point_columns.grid_lon, point_columns.snapped_lat, point_columns.snapped_lon]
+    grids = {
+        f"'{place_title}'!1:1": [list(project_config.place_columns)],
+        f"'{point_title}'!1:1": [point_header],
+        f"'{directions_title}'!1:1": [list(project_config.direction_columns)],
+        # Id columns are read column major
+        f"'{place_title}'!A:A": [[project_config.place_columns.id, "11", "22"]],
+        f"'{point_title}'!B:B": [[point_columns.id, "0", "1", "2", "7"]],
+        f"'{directions_title}'!A:A": [[project_config.direction_columns.id]]
+    }
+    spreadsheets = FakeSpreadsheets(grids, row_counts={0: 1000, 1: 10, 2: 1})
+    client = SimpleNamespace(sheet=SimpleNamespace(service=SimpleNamespace(spreadsheets=lambda: spreadsheets)))
+    spreadsheet = SimpleNamespace(id="spreadsheet", client=client)
+    worksheets = [
+        SimpleNamespace(id=sheet_id, title=title, client=client, spreadsheet=spreadsheet)
+        for sheet_id, title in enumerate((place_title, point_title, directions_title))
+    ]
+    spreadsheet.worksheets = lambda: worksheets
+    return spreadsheet, spreadsheets
+
+def test_read_push_context(project_config: ProjectConfig, fake_spreadsheet: tuple[SimpleNamespace, FakeSpreadsheets]):
+    spreadsheet, _ = fake_spreadsheet
+    context = data_pipeline.read_push_context(spreadsheet, project_config)
+    assert context.existing_place_ids == {"11", "22"}
+    assert context.places.next_row == 4
+    assert context.points.next_row == 6
+    assert context.directions.next_row == 2
+    assert context.next_point_id == 8
+    assert context.next_direction_id == 1
+    assert (context.places.row_count, context.points.row_count, context.directions.row_count) == (1000, 10, 1)
+
+def test_add_map_model_offsets_ids(project_config: ProjectConfig, fake_spreadsheet: tuple[SimpleNamespace, FakeSpreadsheets]):
+    spreadsheet, spreadsheets = fake_spreadsheet
+    place_columns = project_config.place_columns
+    point_columns = project_config.point_columns
+    direction_columns = project_config.direction_columns
+    place_df = pd.DataFrame({column: [33] for column in place_columns})
+    point_df = pd.DataFrame({column: [0.0, 1.0] for column in point_columns})
+    point_df[point_columns.id] = [0, 1]
+    direction_df = pd.DataFrame({column: [None] for column in direction_columns})
+    direction_df[direction_columns.id] = [0]
+    direction_df[direction_columns.origin_id] = [0]
+    direction_df[direction_columns.destination_id] = [1]
+    model = SimpleNamespace(
+        place=SimpleNamespace(id=33, display_name="Place", df=place_df),
+        points=SimpleNamespace(df=point_df),
+        directions=SimpleNamespace(df=direction_df)
+    )
+
+    context = data_pipeline.read_push_context(spreadsheet, project_config)
+    data_pipeline.add_map_model_to_gsheet(model, spreadsheet, project_config, context)
+
+    _, point_update, direction_update = spreadsheets.batch_updates
+    # Point ids continue from the existing maximum, in the second column of the point worksheet
+    point_rows = point_update["requests"][-1]["pasteData"]["data"].split("\n")
+    assert [row.split("\t")[1] for row in point_rows] == ["8", "9"]
+    # Direction ids start at 1, and the point foreign keys get the same offset as the point ids
+    direction_row = direction_update["requests"][-1]["pasteData"]["data"].split("\t")
+    assert direction_row[:3] == ["1", "8", "9"]
+
+    assert "33" in context.existing_place_ids
+    assert context.points.next_row == 8
+    assert context.directions.next_row == 3
+    assert context.next_point_id == 10
+    assert context.next_direction_id == 2
+    # The directions worksheet only had its header row, so one row was appended
+    assert direction_update["requests"][0]["appendDimension"]["length"] == 1
+    assert context.directions.row_count == 2
+
+def test_add_df_to_worksheet_paste_data(fake_spreadsheet: tuple[SimpleNamespace, FakeSpreadsheets]):
+    spreadsheet, spreadsheets = fake_spreadsheet
+    worksheet = spreadsheet.worksheets()[0]
+    df = pd.DataFrame({"a": [1, 2], "b": [np.nan, 0.5]})
+    row_count = data_pipeline.add_df_to_worksheet(df, worksheet, header=["b", "a"], start_row=2, row_count=2)
+    assert row_count == 3
+    requests = spreadsheets.batch_updates[-1]["requests"]
+    assert requests[0]["appendDimension"] == {"sheetId": 0, "dimension": "ROWS", "length": 1}
+    paste_data = requests[1]["pasteData"]
+    assert paste_data["coordinate"] == {"sheetId": 0, "rowIndex": 1, "columnIndex": 0}
+    # Columns follow the header order, and NaN is written as an empty cell
+    assert paste_data["data"] == "\t1\n0.5\t2"
@@ -0,0 +1,107 @@
+"""Tests for map_model.py"""
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import shapely
+from turn_sequence import map_model, utils
+from turn_sequence.config import ProjectConfig
+
+class FakeResponse:
+    """Stands in for a requests.Response with a JSON body."""
+    def __init__(self, data: dict):
+        self._data = data
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return self._data
+
+class FakeSession:
+    """Stands in for a requests.Session, returning the same data for every GET and counting calls."""
+    def __init__(self, data: dict):
+        self.data = data
+        self.calls = 0
+
+    def get(self, url: str, params: dict, timeout: float) -> FakeResponse:
+        self.calls += 1
+        return FakeResponse(self.data)
+
+# Point 0 is on a two-way road and snaps twice, point 1 has no road nearby
+NEAREST_ROADS_DATA = {
+    "snappedPoints": [
+        {"originalIndex": 0, "location": {"latitude": 10.0, "longitude": 20.0}},
+        {"originalIndex": 0, "location": {"latitude": 11.0, "longitude": 21.0}},
+        {"originalIndex": 2, "location": {"latitude": 12.0, "longitude": 22.0}}
+    ]
+}
+
+def test_snap_to_roads_scatters_by_original_index():
+    lons = np.array([1.0, 2.0, 3.0])
+    lats = np.array([4.0, 5.0, 6.0])
+    session = FakeSession(NEAREST_ROADS_DATA)
+    snapped_lons, snapped_lats = map_model.snap_to_roads(lons, lats, "key", session=session)
+    np.testing.assert_array_equal(snapped_lons, [20.0, np.nan, 22.0])
+    np.testing.assert_array_equal(snapped_lats, [10.0, np.nan, 12.0])
+
+def test_snap_to_roads_uses_cache(tmp_path: Path):
+    lons = np.array([1.0, 2.0, 3.0])
+    lats = np.array([4.0, 5.0, 6.0])
+    session = FakeSession(NEAREST_ROADS_DATA)
+    cache = utils.ResponseCache(tmp_path / "roads.sqlite")
+    first = map_model.snap_to_roads(lons, lats, "key", session=session, cache=cache)
+    second = map_model.snap_to_roads(lons, lats, "key", session=session, cache=cache)
+    assert session.calls == 1
+    np.testing.assert_array_equal(first, second)
+
+def test_directions_to_df_skips_empty_routes(project_config: ProjectConfig):
+    direction_columns = project_config.direction_columns
+    indexed_points = [(0, (0.0, 0.0)), (3, (1.0, 1.0)), (5, (2.0, 2.0))]
+    routes = {
+        # 0 -> 5 turns left then right, 3 -> 0 has no distance and no turns.
+        # Every other pair has no route and an empty response.
+        ((0.0, 0.0), (2.0, 2.0)): {"routes": [{
+            "distanceMeters": 1500,
+            "legs": [{"steps": [
+                {"navigationInstruction": {"maneuver": "TURN_LEFT"}},
+                {"navigationInstruction": {"maneuver": "TURN_RIGHT"}}
+            ]}]
+        }]},
+        ((1.0, 1.0), (0.0, 0.0)): {"routes": [{"legs": [{"steps": []}]}]}
+    }
+    # Skip __init__, which needs snapped points, a response cache and an api key
+    directions = object.__new__(map_model.Directions)
+    directions.points = SimpleNamespace(place=SimpleNamespace(id=42))
+    directions._get_route_data = lambda origin, destination: routes.get((origin, destination), {})
+
+    df = directions._to_df(indexed_points, direction_columns)
+
+    assert df[direction_columns.id].tolist() == [0, 1]
+    assert df[direction_columns.origin_id].tolist() == [0, 3]
+    assert df[direction_columns.destination_id].tolist() == [5, 0]
+    assert (df[direction_columns.place_id] == 42).all()
+    np.testing.assert_array_equal(df[direction_columns.distance_km], [1.5, np.nan])
+    assert df[direction_columns.lr_directions].tolist() == [["L", "R"], []]
+    assert df[direction_columns.direction_pairs].tolist() == [["LR"], []]
+
+def _place_points_on(polygon: shapely.Polygon) -> map_model.PlacePoints:
+    """A PlacePoints on a Place stub, skipping __init__, which geocodes and snaps."""
+    points = object.__new__(map_model.PlacePoints)
+    points.place = SimpleNamespace(display_name="Test Place", polygon=polygon)
+    return points
+
+def test_generate_grid_points_unit_square():
+    # A 5 x 5 grid over the unit square. Points on the boundary are not contained,
+    # so only the 3 x 3 interior points remain, in x-major order.
+    points = _place_points_on(shapely.box(0, 0, 1, 1))
+    lons, lats = points._generate_grid_points(4)
+    interior = [0.25, 0.5, 0.75]
+    np.testing.assert_allclose(lons, np.repeat(interior, 3))
+    np.testing.assert_allclose(lats, np.tile(interior, 3))
+
+def test_generate_grid_points_masks_outside_polygon():
+    # The triangle below x + y = 1 shares the unit square bounds, so the grid is the same
+    points = _place_points_on(shapely.Polygon([(0, 0), (1, 0), (0, 1)]))
+    lons, lats = points._generate_grid_points(4)
+    np.testing.assert_allclose(lons, [0.25, 0.25, 0.5])
+    np.testing.assert_allclose(lats, [0.25, 0.5, 0.25])
@@ -0,0 +1,130 @@
+"""Tests for utils.py"""
+from pathlib import Path
+import geopandas as gpd
+import pytest
+import shapely
+from turn_sequence import utils
+
+class FakeClock:
+    """Replaces time.monotonic and time.sleep, advancing only when slept."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def test_response_cache_hit_and_miss(tmp_path: Path):
+    cache = utils.ResponseCache(tmp_path / "cache.sqlite")
+    request = {"url": "https://example.com", "body": {"a": 1, "b": 2}}
+    assert cache.get(request) is None
+    cache.set(request, {"routes": []})
+    assert cache.get(request) == {"routes": []}
+    # A different request is still a miss
+    assert cache.get({"url": "https://example.com", "body": {"a": 1, "b": 3}}) is None
+
+def test_response_cache_key_is_stable(tmp_path: Path):
+    path = tmp_path / "cache.sqlite"
+    utils.ResponseCache(path).set({"url": "https://example.com", "body": {"a": 1, "b": 2}}, {"value": 1})
+    # Keys do not depend on dict order, and entries persist across connections
+    reordered_request = {"body": {"b": 2, "a": 1}, "url": "https://example.com"}
+    assert utils.ResponseCache(path).get(reordered_request) == {"value": 1}
+
+def test_get_response_cache_is_shared(tmp_path: Path):
+    path = tmp_path / "cache.sqlite"
+    assert utils.get_response_cache(path) is utils.get_response_cache(path)
+
+def test_rate_limiter_spacing(monkeypatch: pytest.MonkeyPatch):
+    clock = FakeClock()
+    monkeypatch.setattr(utils.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(utils.time, "sleep", clock.sleep)
+    # One request per second
+    limiter = utils.RateLimiter(requests_per_minute=60)
+    for _ in range(3):
+        limiter.acquire()
+    # The first request starts immediately and each later one waits a full interval
+    assert clock.sleeps == [1.0, 1.0]
+
+    # After an idle period longer than the interval, the next request does not wait
+    clock.now += 5
+    limiter.acquire()
+    assert clock.sleeps == [1.0, 1.0]
+
+@pytest.mark.parametrize("column_index, letters", [(1, "A"), (26, "Z"), (27, "AA"), (28, "AB"), (703, "AAA")])
+def test_get_column_letter(column_index: int, letters: str):
+    assert utils.get_column_letter(column_index) == letters
+
+def test_cached_geocode_to_gdf_round_trip(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    geocoded = gpd.GeoDataFrame({
+        "osm_id": [175905],
+        "display_name": ["Test City, Test State, USA"],
+        "bbox_west": [-74.25],
+        "bbox_south": [40.5],
+        "bbox_east": [-73.7],
+        "bbox_north": [40.9]
+    }, geometry=[shapely.box(-74.25, 40.5, -73.7, 40.9)], crs="EPSG:4326")
+    calls = []
+    def fake_geocode_to_gdf(name: str) -> gpd.GeoDataFrame:
+        calls.append(name)
+        return geocoded.copy()
+    monkeypatch.setattr(utils.ox, "geocode_to_gdf", fake_geocode_to_gdf)
+    monkeypatch.setattr(utils, "CACHE_DIR", tmp_path)
+
+    name = "Test City, Test State, USA"
+    utils.cached_geocode_to_gdf.cache_clear()
+    first = utils.cached_geocode_to_gdf(name)
+    # Clear the in-process memo so the second load comes from the files on disk
+    utils.cached_geocode_to_gdf.cache_clear()
+    second = utils.cached_geocode_to_gdf(name)
+    utils.cached_geocode_to_gdf.cache_clear()
+
+    assert calls == [name]
+    for column in ("osm_id", "display_name", "bbox_west", "bbox_south", "bbox_east", "bbox_north"):
+        assert second.loc[0, column] == first.loc[0, column]
+    assert second.loc[0, "geometry"].equals(first.loc[0, "geometry"])
+    assert second.crs == first.crs
+
+@pytest.mark.parametrize("maneuvers, turns", [
+    (["TURN_SLIGHT_LEFT"], ["L"]),
+    (["UTURN_RIGHT"], ["R"]),
+    (["ROUNDABOUT_LEFT"], ["L"]),
+    (["STRAIGHT"], []),
+    (["NAME_CHANGE"], []),
+    (["DEPART", "TURN_LEFT", "STRAIGHT", "RAMP_RIGHT", "NAME_CHANGE", "TURN_SHARP_LEFT"], ["L", "R", "L"]),
+    ([], [])
+])
+def test_get_turns_from_maneuvers(maneuvers: list[str], turns: list[str]):
+    assert utils.get_turns_from_maneuvers(maneuvers) == turns
+
+@pytest.mark.parametrize("turns, double_turns", [
+    ([], []),
+    (["L"], []),
+    (["L", "R"], ["LR"]),
+    (["L", "L", "R", "R"], ["LL", "LR", "RR"])
+])
+def test_get_double_turns(turns: list[str], double_turns: list[str]):
+    assert utils.get_double_turns(turns) == double_turns
+
+@pytest.mark.parametrize("routes, maneuvers", [
+    ({}, []),
+    ({"routes": []}, []),
+    # Steps without a navigation instruction or maneuver are skipped
+    ({"routes": [{"legs": [{"steps": [
+        {"navigationInstruction": {"maneuver": "DEPART"}},
+        {},
+        {"navigationInstruction": {"instructions": "Continue"}},
+        {"navigationInstruction": {"maneuver": "TURN_LEFT"}}
+    ]}]}]}, ["DEPART", "TURN_LEFT"]),
+    # Maneuvers from every leg are kept in order
+    ({"routes": [{"legs": [
+        {"steps": [{"navigationInstruction": {"maneuver": "TURN_RIGHT"}}]},
+        {},
+        {"steps": [{"navigationInstruction": {"maneuver": "TURN_LEFT"}}]}
+    ]}]}, ["TURN_RIGHT", "TURN_LEFT"])
+])
+def test_get_maneuvers_from_routes(routes: dict, maneuvers: list[str]):
+    assert utils.get_maneuvers_from_routes(routes) == maneuvers